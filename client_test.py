@@ -1,35 +1,85 @@
 import asyncio
 import json
-import httpx
-import os
-from dotenv import load_dotenv
+import aiohttp
+import orjson
 
 # Konfigürasyon
 SERVER_URL = "https://mcp-ragon.onrender.com"
 SSE_ENDPOINT = f"{SERVER_URL}/sse"
 POST_ENDPOINT = f"{SERVER_URL}/messages"
 
+class SSEParser:
+    """
+    SSE çerçeve ayrıştırıcı: feed(chunk) -> [(event, data), ...]
+    Çerçeve sınırları (boş satır) bytes.find ile C seviyesinde aranır,
+    satır satır Python döngüsü yalnızca tamamlanmış çerçevelerde çalışır.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, chunk: bytes):
+        buffer = self.buffer
+        # Önceki baytlar zaten tarandı; yalnızca yeni kısım taranır, böylece
+        # büyük çerçeveler karesel maliyet çıkarmaz. Geriye 1 bayt bölünmüş
+        # "\r\n" için, 2 bayt da "\n\r\n" -> "\n\n" birleşmesi için bakılır.
+        tail = max(0, len(buffer) - 1)
+        resume = max(0, len(buffer) - 2)
+        buffer += chunk
+        if b"\r" in buffer[tail:]:
+            buffer[tail:] = buffer[tail:].replace(b"\r\n", b"\n")
+
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", max(start, resume))
+            if end == -1:
+                break
+
+            event, data = b"message", []
+            for line in buffer[start:end].split(b"\n"):
+                first = line[:1]
+                if first == b"d":  # data:
+                    data.append(line[6:] if line[5:6] == b" " else line[5:])
+                elif first == b"e":  # event:
+                    event = line[6:].strip()
+                # b":" -> yorum (keep-alive), diğerleri yok sayılır
+
+            if data:
+                events.append((event.decode(), b"\n".join(data)))
+            start = end + 2
+
+        del buffer[:start]
+        return events
+
+async def iter_sse(stream):
+    """SSE akışını (event, data) çiftlerine ayırır."""
+    parser = SSEParser()
+    async for chunk in stream.iter_any():
+        for event, data in parser.feed(chunk):
+            yield event, data
+
 async def main():
     print(f"Connecting to {SSE_ENDPOINT}...")
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    # Tek session: SSE ve tüm POST'lar aynı bağlantı havuzunu kullanır
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+    connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=75)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
         # 1. SSE Bağlantısını Başlat
-        async with client.stream("GET", SSE_ENDPOINT) as response:
+        async with client.get(SSE_ENDPOINT) as response:
             print("SSE Connected! Waiting for endpoint event...")
 
-            # SSE Iterator oluştur
-            lines = response.aiter_lines()
+            # SSE event iterator (bytes üzerinde)
+            events = iter_sse(response.content)
             
             dynamic_post_endpoint = None
 
             # İlk event'i bekle (endpoint bildirimi)
-            async for line in lines:
-                if line.startswith("event: endpoint"):
-                    # Bir sonraki satır data olmalı
-                    continue
-                if line.startswith("data: "):
+            async for event, data in events:
+                if event == "endpoint":
                     # Sunucu bize "/messages?session_id=..." dönecek
-                    endpoint_path = line[6:].strip()
+                    endpoint_path = data.decode().strip()
                     dynamic_post_endpoint = f"{SERVER_URL}{endpoint_path}"
                     print(f"Received endpoint: {dynamic_post_endpoint}")
                     break
@@ -54,18 +104,19 @@ async def main():
             
             print("\nSending Initialize...")
             # Artık dinamik endpoint'i kullanıyoruz (session_id içinde)
-            r = await client.post(dynamic_post_endpoint, json=init_payload)
-            print(f"Init status: {r.status_code}")
-            if r.status_code != 202 and r.status_code != 200:
-                print(f"Init failed: {r.text}")
-                return
+            async with client.post(dynamic_post_endpoint, json=init_payload) as r:
+                print(f"Init status: {r.status}")
+                if r.status != 202 and r.status != 200:
+                    print(f"Init failed: {await r.text()}")
+                    return
 
             # 3. Initialized Notification
             max_payload = {
                 "jsonrpc": "2.0",
                 "method": "notifications/initialized"
             }
-            await client.post(dynamic_post_endpoint, json=max_payload)
+            async with client.post(dynamic_post_endpoint, json=max_payload):
+                pass
 
             # 4. Tool Listeleme
             list_tools_payload = {
@@ -75,7 +126,8 @@ async def main():
             }
             
             print("\nRequesting Tools List...")
-            await client.post(dynamic_post_endpoint, json=list_tools_payload)
+            async with client.post(dynamic_post_endpoint, json=list_tools_payload):
+                pass
             
             # 5. Arama Yapma (Test Query)
             query = "saha sorumlusu görevleri"
@@ -90,16 +142,16 @@ async def main():
             }
             
             print(f"\nCalling Tool 'search_knowledge_base' with query: '{query}'...")
-            await client.post(dynamic_post_endpoint, json=call_tool_payload)
+            async with client.post(dynamic_post_endpoint, json=call_tool_payload):
+                pass
 
             print("\nListening for responses (Process will stop after receiving results)...")
             
             # Kalan eventleri oku
-            async for line in lines:
-                if line.startswith("data: "):
-                    data_str = line[6:]
+            async for event, data_bytes in events:
+                if event == "message":
                     try:
-                        data = json.loads(data_str)
+                        data = orjson.loads(data_bytes)
                         
                         # JSON-RPC Response Kontrolü
                         if "result" in data:
@@ -126,7 +178,7 @@ async def main():
                         if "error" in data:
                             print(f"\n[Error] {data['error']}")
                             
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         pass
                         
 if __name__ == "__main__":
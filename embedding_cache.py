@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Callable, List
+
+# Persistent embedding store: (model, sha256(text)) -> float32 vector.
+# Set RAGON_EMBEDDING_CACHE to move the database (e.g. onto a mounted disk).
+CACHE_PATH = os.getenv("RAGON_EMBEDDING_CACHE") or os.path.join(os.path.dirname(__file__), "embedding_cache.sqlite3")
+# Oldest rows are evicted past this count (~6 KB each for text-embedding-3-small)
+MAX_ROWS = int(os.getenv("RAGON_EMBEDDING_CACHE_MAX_ROWS", "10000"))
+
+# SQLite connections can't be shared across threads; searches run in a threadpool.
+_local = threading.local()
+
+def _connect() -> sqlite3.Connection:
+    """Return this thread's connection, creating the table on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_PATH)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS emb (model TEXT, hash BLOB, vec BLOB, PRIMARY KEY (model, hash))")
+        _local.conn = conn
+    return conn
+
+def _hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+def get_or_compute_many(texts: List[str], model: str, compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+    """
+    Return embeddings for texts, in order.
+    Cached vectors are read from SQLite; all misses are passed to compute() in one call and stored,
+    evicting the oldest rows beyond MAX_ROWS.
+    The cache is best effort: database errors fall back to compute().
+    """
+    if not texts:
+        return []
+
+    hashes = [_hash(t) for t in texts]
+    found = {}
+
+    try:
+        conn = _connect()
+        placeholders = ",".join("?" * len(hashes))
+        rows = conn.execute(f"SELECT hash, vec FROM emb WHERE model = ? AND hash IN ({placeholders})", (model, *hashes))
+        for h, blob in rows:
+            found[h] = array("f", blob).tolist()
+    except sqlite3.Error:
+        conn = None
+
+    missing = [i for i, h in enumerate(hashes) if h not in found]
+    if missing:
+        vectors = compute([texts[i] for i in missing])
+        for i, vec in zip(missing, vectors):
+            found[hashes[i]] = vec
+
+        if conn is not None:
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO emb (model, hash, vec) VALUES (?, ?, ?)",
+                        [(model, hashes[i], array("f", vec).tobytes()) for i, vec in zip(missing, vectors)]
+                    )
+                    # Replaced rows get a new rowid, so rowid order is insertion order
+                    conn.execute(
+                        "DELETE FROM emb WHERE rowid IN (SELECT rowid FROM emb ORDER BY rowid LIMIT max(0, (SELECT count(*) FROM emb) - ?))",
+                        (MAX_ROWS,)
+                    )
+            except sqlite3.Error:
+                pass
+
+    return [found[h] for h in hashes]
@@ -1,20 +1,180 @@
 import asyncio
-import json
+import os
+import time
+import uuid
+import orjson
 import uvicorn
+import redis.asyncio as aioredis
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import StreamingResponse
-from ragon_core import search_organizational_memory
+from ragon_core import search_organizational_memory, embedding_cache_info
+
+# Tool output is read by agents, so it is compact by default.
+# Set RAGON_PRETTY=1 to indent it for debugging.
+TOOL_JSON_OPTION = orjson.OPT_INDENT_2 if os.getenv("RAGON_PRETTY") == "1" else 0
+
+def _tool_contents(query: str, deep: bool) -> tuple:
+    """
+    Search and serialize the tool output.
+    A small header comes first, then one text per match and per deep insight,
+    so clients can handle each item on its own.
+    Repeated queries are served by ragon_core's result cache.
+    """
+    results = search_organizational_memory(query, deep_mode=deep)
+    matches = results.get('results', [])
+    top_matches = matches[:5]
+    deep_insights = results.get('deep_results', [])[:3]
+    header = {
+        "summary": f"Found {len(matches)} direct matches.",
+        "matches": len(top_matches),
+        "deep_insights": len(deep_insights)
+    }
+    return tuple(
+        orjson.dumps(item, option=TOOL_JSON_OPTION).decode()
+        for item in (header, *top_matches, *deep_insights)
+    )
+
+# Worker threads for blocking searches (OpenAI/Supabase I/O via asyncio.to_thread)
+SEARCH_THREADS = 32
+
+# Optional Redis routing: with REDIS_URL set, a POST handled by any worker or
+# instance reaches the SSE stream of its session. Without it, sessions are
+# local to this process.
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL = 3600
+# Busy streams never hit the ping timeout, so the key is refreshed on this timer
+SESSION_TTL_REFRESH = 60
+redis_client = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_client
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=SEARCH_THREADS))
+    if REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL)
+    elif int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        # The kernel spreads connections across workers, so a session's POSTs
+        # land on workers that don't hold its stream and get 400
+        print("Warning: WEB_CONCURRENCY > 1 without REDIS_URL; SSE sessions will break. Set REDIS_URL or use one worker.")
+    sweeper = asyncio.create_task(sweep_idle_sessions())
+    yield
+    sweeper.cancel()
+    if redis_client is not None:
+        await redis_client.aclose()
 
 # 1. Initialize FastAPI App
-app = FastAPI(title="RAGON MCP Server - Manual Implementation")
+app = FastAPI(title="RAGON MCP Server - Manual Implementation", lifespan=lifespan)
+
+# Keep proxies (nginx, Render) from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Max queued messages flushed together in one write
+SSE_BATCH_LIMIT = 16
+
+# Seconds of silence before a keep-alive comment is sent, so proxies
+# don't drop the stream during long searches
+SSE_PING_INTERVAL = 15
+
+def sse_frame(event: bytes, data: bytes) -> bytes:
+    """Build a raw SSE frame; orjson output is already bytes."""
+    return b"".join((b"event: ", event, b"\ndata: ", data, b"\n\n"))
 
 @app.get("/")
 async def root():
-    return {"status": "online", "message": "RAGON MCP Server is running (Manual Mode)"}
+    return {
+        "status": "online",
+        "message": "RAGON MCP Server is running (Manual Mode)",
+        "embedding_cache": embedding_cache_info()
+    }
 
 # 2. Global Event Helper
-# Store client queues: session_id -> asyncio.Queue
+# Store client queues: session_id -> asyncio.Queue of encoded JSON-RPC messages
 CLIENT_QUEUES = {}
+# session_id -> monotonic time its stream last waited on the queue
+LAST_ACTIVITY = {}
+# session_id -> task relaying its Redis channel (only with REDIS_URL)
+RELAY_TASKS = {}
+
+# Bounded per-session buffer: a client that stops reading is dropped
+# instead of piling up search payloads in memory
+SESSION_QUEUE_SIZE = 64
+SESSION_IDLE_TIMEOUT = 300
+SWEEP_INTERVAL = 60
+
+def _session_key(session_id):
+    return f"mcp:session:{session_id}"
+
+def _session_channel(session_id):
+    return f"mcp:{session_id}"
+
+async def session_exists(session_id):
+    """True if the session's SSE stream is open on this or (with Redis) any worker."""
+    if session_id in CLIENT_QUEUES:
+        return True
+    return redis_client is not None and await redis_client.exists(_session_key(session_id)) > 0
+
+async def _forget_session_key(session_id):
+    try:
+        await redis_client.delete(_session_key(session_id))
+    except Exception:
+        pass
+
+def drop_session(session_id, reason):
+    """Forget a stuck session, free its buffered messages and tell its stream to close."""
+    queue = CLIENT_QUEUES.pop(session_id, None)
+    LAST_ACTIVITY.pop(session_id, None)
+    if queue is None:
+        return
+    print(f"Dropping session {session_id}: {reason}")
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None) # Shutdown signal
+
+    # The stream may be stuck in a blocked write and never reach its cleanup;
+    # end the session for other workers now so their POSTs get 400
+    relay = RELAY_TASKS.pop(session_id, None)
+    if relay is not None:
+        if relay is not asyncio.current_task():
+            relay.cancel()
+        asyncio.create_task(_forget_session_key(session_id))
+
+async def sweep_idle_sessions():
+    """Periodically drop sessions whose stream hasn't drained its queue for SESSION_IDLE_TIMEOUT."""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        cutoff = time.monotonic() - SESSION_IDLE_TIMEOUT
+        for session_id, last_seen in list(LAST_ACTIVITY.items()):
+            if last_seen < cutoff:
+                drop_session(session_id, "idle")
+
+def _enqueue(session_id, queue, data):
+    try:
+        queue.put_nowait(data)
+    except asyncio.QueueFull:
+        drop_session(session_id, "queue full")
+
+async def send_to_session(session_id, message):
+    """Deliver a JSON-RPC message to the session's SSE stream, wherever it is connected."""
+    data = orjson.dumps(message)
+    queue = CLIENT_QUEUES.get(session_id)
+    if queue is not None:
+        _enqueue(session_id, queue, data)
+    elif redis_client is not None:
+        await redis_client.publish(_session_channel(session_id), data)
+
+async def _relay_from_redis(session_id, queue, pubsub):
+    """Forward messages published for this session by other workers into its local queue."""
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                _enqueue(session_id, queue, message["data"])
+    except Exception as e:
+        # Without the relay the session would silently miss cross-worker replies
+        drop_session(session_id, f"redis relay failed: {e}")
+    finally:
+        await pubsub.aclose()
 
 @app.get("/sse")
 async def handle_sse(request: Request):
@@ -22,10 +182,21 @@ async def handle_sse(request: Request):
     Establish SSE connection.
     Generate a session ID and yield events from the corresponding queue.
     """
-    import uuid
-    session_id = str(uuid.uuid4())
-    queue = asyncio.Queue()
+    session_id = uuid.uuid4().hex
+    queue = asyncio.Queue(maxsize=SESSION_QUEUE_SIZE)
+    
+    pubsub = None
+    if redis_client is not None:
+        # Subscribe before the endpoint is announced, so a reply published by
+        # another worker right after the client's first POST isn't lost
+        pubsub = redis_client.pubsub()
+        await pubsub.subscribe(_session_channel(session_id))
+        await redis_client.setex(_session_key(session_id), SESSION_TTL, 1)
+    
     CLIENT_QUEUES[session_id] = queue
+    LAST_ACTIVITY[session_id] = time.monotonic()
+    if pubsub is not None:
+        RELAY_TASKS[session_id] = asyncio.create_task(_relay_from_redis(session_id, queue, pubsub))
     
     async def event_generator():
         try:
@@ -38,23 +209,46 @@ async def handle_sse(request: Request):
             # We can also handle session via query param in POST url.
             
             endpoint_url = f"/messages?session_id={session_id}"
-            yield f"event: endpoint\ndata: {endpoint_url}\n\n"
+            yield sse_frame(b"endpoint", endpoint_url.encode())
             
             # 2. Listen to Queue
+            ttl_refreshed = time.monotonic()
             while True:
                 # Wait for messages intended for this client
-                data = await queue.get()
+                now = LAST_ACTIVITY[session_id] = time.monotonic()
+                if pubsub is not None and now - ttl_refreshed > SESSION_TTL_REFRESH:
+                    await redis_client.expire(_session_key(session_id), SESSION_TTL)
+                    ttl_refreshed = now
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=SSE_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
                 if data is None: break # Shutdown signal
                 
-                # Yield as message event
-                yield f"event: message\ndata: {json.dumps(data)}\n\n"
+                # Drain whatever else is already queued so a burst goes out in
+                # one write. Each message keeps its own event (MCP expects one
+                # JSON-RPC message per event), they just share the send.
+                frames = [sse_frame(b"message", data)]
+                while len(frames) < SSE_BATCH_LIMIT and not queue.empty():
+                    data = queue.get_nowait()
+                    if data is None: break
+                    frames.append(sse_frame(b"message", data))
+                
+                yield b"".join(frames)
+                if data is None: break
                 
         except asyncio.CancelledError:
             print(f"Client {session_id} disconnected.")
         finally:
             CLIENT_QUEUES.pop(session_id, None)
+            LAST_ACTIVITY.pop(session_id, None)
+            relay = RELAY_TASKS.pop(session_id, None)
+            if relay is not None:
+                relay.cancel()
+                await _forget_session_key(session_id)
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @app.post("/messages")
 async def handle_messages(request: Request):
@@ -63,11 +257,11 @@ async def handle_messages(request: Request):
     """
     session_id = request.query_params.get("session_id")
     
-    if not session_id or session_id not in CLIENT_QUEUES:
+    if not session_id or not await session_exists(session_id):
         return Response(status_code=400, content="Invalid or missing session_id")
     
     try:
-        payload = await request.json()
+        payload = orjson.loads(await request.body())
     except Exception:
         return Response(status_code=400, content="Invalid JSON")
     
@@ -77,13 +271,61 @@ async def handle_messages(request: Request):
     
     return Response(status_code=202)
 
+# 3. Static Tool Definitions (built once, returned on every tools/list)
+_INPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "query": {
+            "type": "string",
+            "description": "Specific search query related to internal documents."
+        }
+    },
+    "required": ["query"]
+}
+
+TOOLS = [
+    {
+        "name": "search_knowledge_base",
+        "description": "Searches the internal company knowledge base (RAGON Memory). Use this tool ONLY when the user asks specifically about internal company policies, job descriptions, roles (e.g., Saha Sorumlusu), authority limits, project procedures, or organizational decisions. Do NOT use this tool for general knowledge questions (e.g., world facts, coding help, math) or simple greetings.",
+        "inputSchema": _INPUT_SCHEMA
+    }
+]
+
+async def search_knowledge_base(args):
+    """Run the RAG search and return the tool's content items."""
+    query = args.get("query")
+    if not isinstance(query, str):
+        raise ValueError("'query' must be a string")
+    # Perform Search off the event loop;
+    # it blocks on OpenAI/Supabase and serializes the output
+    texts = await asyncio.to_thread(_tool_contents, query, True)
+    return [{"type": "text", "text": text} for text in texts]
+
+# Tool name -> async handler(arguments) returning MCP content items
+TOOL_HANDLERS = {"search_knowledge_base": search_knowledge_base}
+
+# Static results, identical for every session
+INITIALIZE_RESULT = {
+    "protocolVersion": "2024-11-05", # Latest known spec date
+    "capabilities": {
+        "tools": {} # We support tools
+    },
+    "serverInfo": {
+        "name": "ragon-manual",
+        "version": "1.0.0"
+    }
+}
+TOOLS_LIST_RESULT = {"tools": TOOLS}
+
+# Encoded once; orjson copies Fragments verbatim, so per call only the
+# envelope and id are serialized
+INITIALIZE_RESULT_JSON = orjson.Fragment(orjson.dumps(INITIALIZE_RESULT))
+TOOLS_LIST_RESULT_JSON = orjson.Fragment(orjson.dumps(TOOLS_LIST_RESULT))
+
 async def process_rpc_request(session_id, request):
     """
     Manual JSON-RPC Processor
     """
-    queue = CLIENT_QUEUES.get(session_id)
-    if not queue: return
-    
     rpc_id = request.get("id")
     method = request.get("method")
     params = request.get("params", {})
@@ -94,16 +336,7 @@ async def process_rpc_request(session_id, request):
         response = {
             "jsonrpc": "2.0",
             "id": rpc_id,
-            "result": {
-                "protocolVersion": "2024-11-05", # Latest known spec date
-                "capabilities": {
-                    "tools": {} # We support tools
-                },
-                "serverInfo": {
-                    "name": "ragon-manual",
-                    "version": "1.0.0"
-                }
-            }
+            "result": INITIALIZE_RESULT_JSON
         }
     
     elif method == "notifications/initialized":
@@ -114,54 +347,31 @@ async def process_rpc_request(session_id, request):
         response = {
             "jsonrpc": "2.0",
             "id": rpc_id,
-            "result": {
-                "tools": [
-                    {
-                        "name": "search_knowledge_base",
-                        "description": "Searches the internal company knowledge base (RAGON Memory). Use this tool ONLY when the user asks specifically about internal company policies, job descriptions, roles (e.g., Saha Sorumlusu), authority limits, project procedures, or organizational decisions. Do NOT use this tool for general knowledge questions (e.g., world facts, coding help, math) or simple greetings.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "query": {
-                                    "type": "string",
-                                    "description": "Specific search query related to internal documents."
-                                }
-                            },
-                            "required": ["query"]
-                        }
-                    }
-                ]
-            }
+            "result": TOOLS_LIST_RESULT_JSON
         }
         
     elif method == "tools/call":
         tool_name = params.get("name")
         args = params.get("arguments", {})
+        handler = TOOL_HANDLERS.get(tool_name)
         
-        if tool_name == "search_knowledge_base":
-            try:
-                query = args.get("query")
-                # Perform Search
-                results = search_organizational_memory(query, deep_mode=True)
-                
-                output_data = {
-                    "summary": f"Found {len(results.get('results', []))} direct matches.",
-                    "matches": results.get('results', [])[:5],
-                    "deep_insights": results.get('deep_results', [])[:3]
+        if handler is None:
+            # Unknown Tool
+            response = {
+                "jsonrpc": "2.0",
+                "id": rpc_id,
+                "error": {
+                    "code": -32601,
+                    "message": f"Method {tool_name} not found"
                 }
-                
-                content_text = json.dumps(output_data, ensure_ascii=False, indent=2)
-                
+            }
+        else:
+            try:
                 response = {
                     "jsonrpc": "2.0",
                     "id": rpc_id,
                     "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": content_text
-                            }
-                        ],
+                        "content": await handler(args),
                         "isError": False
                     }
                 }
@@ -179,16 +389,6 @@ async def process_rpc_request(session_id, request):
                         "isError": True
                     }
                 }
-        else:
-            # Unknown Tool
-            response = {
-                "jsonrpc": "2.0",
-                "id": rpc_id,
-                "error": {
-                    "code": -32601,
-                    "message": f"Method {tool_name} not found"
-                }
-            }
             
     elif method == "ping":
         response = {"jsonrpc": "2.0", "id": rpc_id, "result": {}}
@@ -205,9 +405,12 @@ async def process_rpc_request(session_id, request):
                 }
             }
             
-    # Send response back to queue
+    # Send response back to the session's stream
     if response:
-        await queue.put(response)
+        await send_to_session(session_id, response)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # loop="auto" picks uvloop when installed (not available on Windows).
+    # Worker count comes from WEB_CONCURRENCY (default 1); multiple workers
+    # need the app as an import string and REDIS_URL for session routing.
+    uvicorn.run("mcp_server:app", host="0.0.0.0", port=8000, loop="auto", http="httptools", log_level="warning")
@@ -1,8 +1,15 @@
 import os
 import json
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import httpx
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from openai import OpenAI
+from embedding_cache import get_or_compute_many
 from typing import List, Dict, Any, Optional
 
 # Load env vars (support both local .env and system envs)
@@ -12,52 +19,168 @@ load_dotenv()
 supabase: Optional[Client] = None
 openai_client: Optional[OpenAI] = None
 RAG_CONFIG: Dict = {}
+_initialized = False
+_init_lock = threading.Lock()
 
-def init_clients():
-    """Initialize Supabase and OpenAI clients if not already initialized."""
-    global supabase, openai_client, RAG_CONFIG
-    
-    if supabase is not None and openai_client is not None:
-        return
+# Search config, parsed once and reloaded only when the file's mtime changes
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'rag_config.json')
+DEFAULT_RAG_CONFIG = {
+    "folder_weights": {},
+    "search_params": {"base_match_count": 8, "full_text_weight": 1.0, "semantic_weight": 1.0, "recency_weight": 0.5}
+}
+_CONFIG_CACHE = None # (mtime, config)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# In-process LRU in front of the on-disk cache: normalized text -> embedding
+_EMBED_LRU: "OrderedDict[str, tuple]" = OrderedDict()
+_EMBED_LRU_MAXSIZE = 1024
+_EMBED_LRU_LOCK = threading.Lock()
+_EMBED_LRU_STATS = {"hits": 0, "misses": 0}
+
+# Threads for fanning out independent Supabase RPCs within one search
+_RPC_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ragon-rpc")
+
+# Linked basenames resolved per rag_documents request
+_LINK_PATH_BATCH = 20
 
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Whole-pipeline results for repeated identical queries: (query_text, deep_mode) -> result
+_RESULT_CACHE = TTLCache(maxsize=256, ttl=60)
+_RESULT_CACHE_LOCK = threading.Lock()
 
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY environment variables.")
+def load_rag_config() -> Dict:
+    """Return the parsed rag_config.json, re-reading it only when the file changes."""
+    global RAG_CONFIG, _CONFIG_CACHE
+    try:
+        mtime = os.path.getmtime(CONFIG_PATH)
+    except OSError:
+        mtime = None
 
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    if _CONFIG_CACHE is not None and _CONFIG_CACHE[0] == mtime:
+        return _CONFIG_CACHE[1]
 
-    # Load Config
-    config_path = os.path.join(os.path.dirname(__file__), 'rag_config.json')
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            RAG_CONFIG = json.load(f)
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            config = json.load(f)
     except Exception:
         # Default config if file is missing
-        RAG_CONFIG = {
-            "folder_weights": {},
-            "search_params": {"base_match_count": 8, "full_text_weight": 1.0, "semantic_weight": 1.0, "recency_weight": 0.5}
-        }
+        config = DEFAULT_RAG_CONFIG
 
-def get_embedding(text: str) -> List[float]:
-    """Generate embedding for query text."""
+    _CONFIG_CACHE = (mtime, config)
+    RAG_CONFIG = config
+    return config
+
+load_rag_config()
+
+def init_clients():
+    """Initialize Supabase and OpenAI clients if not already initialized (thread-safe)."""
+    global supabase, openai_client, _initialized
+    
+    if _initialized:
+        return
+
+    with _init_lock:
+        if _initialized:
+            return
+
+        SUPABASE_URL = os.getenv("SUPABASE_URL")
+        SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+        OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY environment variables.")
+
+        # One pooled HTTP/2 connection set shared by Supabase (PostgREST) and OpenAI
+        http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=30.0
+        )
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=http_client))
+        openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=2)
+        _initialized = True
+
+def _create_embeddings(texts: List[str]) -> List[List[float]]:
+    """Call OpenAI for the given texts in a single request."""
     if openai_client is None:
         init_clients()
-    text = text.replace("\n", " ")
-    return openai_client.embeddings.create(input=[text], model="text-embedding-3-small").data[0].embedding
+    response = openai_client.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+    return [d.embedding for d in response.data]
+
+def _normalize(text: str) -> str:
+    return text.replace("\n", " ").strip()
+
+def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Generate embeddings for several query texts.
+    Lookup order: in-process LRU, then the on-disk cache, then one OpenAI request for the rest.
+    """
+    texts = [_normalize(t) for t in texts]
+    unique = list(dict.fromkeys(texts)) # Repeated texts count once in the stats
+    vectors = {}
+
+    with _EMBED_LRU_LOCK:
+        for t in unique:
+            vec = _EMBED_LRU.get(t)
+            if vec is not None:
+                _EMBED_LRU.move_to_end(t)
+                vectors[t] = vec
+        missing = [t for t in unique if t not in vectors]
+        _EMBED_LRU_STATS["hits"] += len(unique) - len(missing)
+        _EMBED_LRU_STATS["misses"] += len(missing)
+
+    if missing:
+        computed = get_or_compute_many(missing, EMBEDDING_MODEL, _create_embeddings)
+        with _EMBED_LRU_LOCK:
+            for t, vec in zip(missing, computed):
+                vectors[t] = _EMBED_LRU[t] = tuple(vec)
+            while len(_EMBED_LRU) > _EMBED_LRU_MAXSIZE:
+                _EMBED_LRU.popitem(last=False)
+
+    return [list(vectors[t]) for t in texts]
+
+def get_embedding(text: str) -> List[float]:
+    """Generate embedding for query text."""
+    return get_embeddings_batch([text])[0]
+
+def embedding_cache_info() -> Dict[str, int]:
+    """Hit/miss counters of the in-process embedding LRU."""
+    with _EMBED_LRU_LOCK:
+        return {**_EMBED_LRU_STATS, "size": len(_EMBED_LRU), "maxsize": _EMBED_LRU_MAXSIZE}
+
+def _rpc(name: str, params: Dict[str, Any]):
+    return supabase.rpc(name, params).execute()
 
 def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dict[str, Any]:
     """
     Core RAG search logic.
     Returns a dictionary with results instead of printing to stdout.
+    Blank queries return an empty result without any network calls; identical
+    queries within the cache TTL reuse the previous result.
     """
+    if not query_text or not query_text.strip():
+        return {"results": [], "deep_results": [], "log": []}
+
+    key = (query_text, deep_mode)
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    result = _run_search(query_text, deep_mode)
+
+    # Only cache clean runs so transient errors are retried
+    if not result["log"]:
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[key] = result
+    return result
+
+def _run_search(query_text: str, deep_mode: bool) -> Dict[str, Any]:
     init_clients()
+    config = load_rag_config()
     
-    search_params = RAG_CONFIG.get("search_params", {})
-    folder_weights = RAG_CONFIG.get("folder_weights", {})
+    search_params = config.get("search_params", {})
+    folder_weights = config.get("folder_weights", {})
     base_match_count = search_params.get("base_match_count", 8)
 
     # 1. Multi-Query Analysis
@@ -66,31 +189,39 @@ def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dic
     
     current_limit = base_match_count if not is_multi_query else max(4, int(base_match_count * 0.6))
     
-    all_results = []
+    by_id: Dict[Any, Dict] = {} # chunk_id -> merged result
     response_log = [] # To capture process logs if needed
 
-    # 2. Search for each sub-query
-    for q in sub_queries:
+    # 2. Search for each sub-query (all embedded in one request)
+    try:
+        query_vectors = get_embeddings_batch(sub_queries) if sub_queries else []
+    except Exception as e:
+        query_vectors = []
+        response_log.append(f"Error embedding queries: {str(e)}")
+
+    # Sub-queries are independent: run their RPCs concurrently, merge in order
+    futures = []
+    for q, query_vector in zip(sub_queries, query_vectors):
+        params = {
+            "query_text": q,
+            "query_embedding": query_vector,
+            "match_count": current_limit,
+            "full_text_weight": search_params.get("full_text_weight", 1.0),
+            "semantic_weight": search_params.get("semantic_weight", 1.0),
+            "recency_weight": search_params.get("recency_weight", 0.5),
+            "folder_weights": folder_weights
+        }
+        futures.append(_RPC_POOL.submit(_rpc, "hybrid_search", params))
+
+    for q, future in zip(sub_queries, futures):
         try:
-            query_vector = get_embedding(q)
-            
-            params = {
-                "query_text": q,
-                "query_embedding": query_vector,
-                "match_count": current_limit,
-                "full_text_weight": search_params.get("full_text_weight", 1.0),
-                "semantic_weight": search_params.get("semantic_weight", 1.0),
-                "recency_weight": search_params.get("recency_weight", 0.5),
-                "folder_weights": folder_weights
-            }
-            
-            response = supabase.rpc("hybrid_search", params).execute()
+            response = future.result()
             
             for rank, r in enumerate(response.data):
                 chunk_id = r['chunk_id']
                 rrf_score = 1.0 / (60 + rank)
                 
-                existing = next((x for x in all_results if x['chunk_id'] == chunk_id), None)
+                existing = by_id.get(chunk_id)
                 
                 if existing:
                     existing['_rrf_score'] += rrf_score
@@ -98,13 +229,14 @@ def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dic
                 else:
                     r['_rrf_score'] = rrf_score
                     r['_matched_queries'] = [q]
-                    all_results.append(r)
+                    by_id[chunk_id] = r
                     
         except Exception as e:
             response_log.append(f"Error querying '{q}': {str(e)}")
 
     # 3. Sort Results
-    all_results.sort(key=lambda x: x['_rrf_score'], reverse=True)
+    all_results = list(by_id.values())
+    all_results.sort(key=itemgetter('_rrf_score'), reverse=True)
     final_results = all_results[:12] if is_multi_query else all_results
 
     if not final_results:
@@ -114,31 +246,23 @@ def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dic
     linked_doc_ids = set()
     formatted_results = []
 
+    # Link Lookup: one query for every result document
+    links_by_doc = defaultdict(list)
+    doc_ids = list(dict.fromkeys(res.get('document_id') for res in final_results if res.get('document_id')))
+    if doc_ids:
+        try:
+            links_res = supabase.table("rag_links").select("source_doc_id,target_doc_path").in_("source_doc_id", doc_ids).execute()
+            for l in links_res.data:
+                links_by_doc[l['source_doc_id']].append(l['target_doc_path'])
+        except Exception as e:
+            response_log.append(f"Error fetching links: {str(e)}")
+
     for res in final_results:
         doc_id = res.get('document_id')
         repo_path = res.get('repo_path', 'Unknown')
         
-        # Link Lookup
-        references = []
-        if doc_id:
-            try:
-                links_res = supabase.table("rag_links").select("target_doc_path").eq("source_doc_id", doc_id).execute()
-                if links_res.data:
-                    # Collect target paths for return
-                    references = [l['target_doc_path'] for l in links_res.data]
-                    
-                    # Collect IDs for Deep Search (using basename logic)
-                    if deep_mode:
-                        target_paths = [os.path.basename(l['target_doc_path']) for l in links_res.data]
-                        clean_paths = [tp.split('#')[0] for tp in target_paths if tp.strip()]
-                        
-                        if clean_paths:
-                            or_condition = ",".join([f"repo_path.ilike.%{tp}%" for tp in clean_paths])
-                            target_docs = supabase.table("rag_documents").select("id").or_(or_condition).execute()
-                            for d in target_docs.data:
-                                linked_doc_ids.add(d['id'])
-            except Exception:
-                pass
+        # Collect target paths for return
+        references = links_by_doc.get(doc_id, [])
 
         formatted_results.append({
             "content": res.get('content', '').strip(),
@@ -148,22 +272,52 @@ def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dic
             "matched_queries": res.get('_matched_queries', [])
         })
 
+    # Collect IDs for Deep Search (using basename logic), one query for all links
+    if deep_mode and links_by_doc:
+        target_paths = [os.path.basename(tp) for refs in links_by_doc.values() for tp in refs]
+        clean_paths = list(dict.fromkeys(tp.split('#')[0] for tp in target_paths if tp.strip()))
+        
+        # The filter travels in the GET query string; keep each request's URL bounded
+        for i in range(0, len(clean_paths), _LINK_PATH_BATCH):
+            batch = clean_paths[i:i + _LINK_PATH_BATCH]
+            try:
+                or_condition = ",".join([f"repo_path.ilike.%{tp}%" for tp in batch])
+                target_docs = supabase.table("rag_documents").select("id").or_(or_condition).execute()
+                for d in target_docs.data:
+                    linked_doc_ids.add(d['id'])
+            except Exception as e:
+                response_log.append(f"Error resolving linked documents: {str(e)}")
+
     # 5. Batch Deep Search
     deep_search_results = []
     if deep_mode and linked_doc_ids:
         queries_to_run = sub_queries if is_multi_query else [query_text]
         all_deep_matches = []
         
-        for dq in queries_to_run:
+        # Reuse the sub-query vectors; embed anything new in one request
+        deep_vectors = dict(zip(sub_queries, query_vectors))
+        missing = [dq for dq in queries_to_run if dq not in deep_vectors]
+        if missing:
+            try:
+                deep_vectors.update(zip(missing, get_embeddings_batch(missing)))
+            except Exception as e:
+                response_log.append(f"Deep search embedding error: {str(e)}")
+        
+        target_doc_ids = list(linked_doc_ids)
+        deep_futures = [
+            (dq, _RPC_POOL.submit(_rpc, "match_chunks_in_docs", {
+                "query_embedding": deep_vectors[dq],
+                "match_threshold": 0.35, # Synced with latest optimization
+                "match_count": 5, 
+                "target_doc_ids": target_doc_ids,
+                "query_text": dq
+            }))
+            for dq in queries_to_run if dq in deep_vectors
+        ]
+        
+        for dq, future in deep_futures:
             try:
-                dq_vec = get_embedding(dq)
-                deep_res = supabase.rpc("match_chunks_in_docs", {
-                    "query_embedding": dq_vec,
-                    "match_threshold": 0.35, # Synced with latest optimization
-                    "match_count": 5, 
-                    "target_doc_ids": list(linked_doc_ids),
-                    "query_text": dq
-                }).execute()
+                deep_res = future.result()
                 
                 if deep_res.data:
                     all_deep_matches.extend(deep_res.data)
@@ -172,7 +326,7 @@ def search_organizational_memory(query_text: str, deep_mode: bool = True) -> Dic
 
         # Deduplicate Deep Results
         unique_deep = {res['chunk_id']: res for res in all_deep_matches}.values()
-        sorted_deep = sorted(unique_deep, key=lambda x: x['similarity'], reverse=True)[:6]
+        sorted_deep = sorted(unique_deep, key=itemgetter('similarity'), reverse=True)[:6]
         
         for dr in sorted_deep:
             deep_search_results.append({